@@ -1,7 +1,7 @@
 from .dossier import Dossier, DossierState
 from .demarche import Demarche
 from .connection import Profile
-from .actions import StateModifier, MessageSender, AnnotationModifier, FileUploader
+from .actions import StateModifier, MessageSender, AnnotationModifier, FileUploader, ActionBatch
 from .fields import Field, TextField, MapField, AttachedFileField, DateField, MultipleDropDownField
 from .utils import GeoSource,GeoArea
 
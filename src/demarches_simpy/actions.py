@@ -1,7 +1,8 @@
 import hashlib
 import base64
+from functools import partial
 
-from .connection import FileUploadRequestBuilder, Profile
+from .connection import FileUploadRequestBuilder, RequestBuilder, Profile, parse_mutations, compile_input_encoder
 from .utils import DemarchesSimpyException
 from .dossier import DossierState, Dossier
 from .interfaces import IAction, ILog
@@ -17,6 +18,22 @@ from .interfaces import IAction, ILog
 # on its own
 #######################
 
+# Keys an anotation must have, depending on whether a value is given to perform
+_ANOTATION_KEYS = frozenset(('id', 'stringValue'))
+_ANOTATION_KEYS_WITH_VALUE = frozenset(('id',))
+
+# Mutation to call for each target state, keyed by state value as DossierState is not hashable
+_OP_NAMES = {
+    DossierState.CONSTRUCTION.value : "dossierRepasserEnConstruction",
+    DossierState.INSTRUCTION.value : "dossierRepasserEnInstruction",
+    DossierState.ACCEPTE.value : "dossierAccepter",
+    DossierState.REFUSE.value : "dossierRefuser",
+    DossierState.SANS_SUITE.value : "dossierClasserSansSuite",
+}
+# A dossier still en construction is passed, not repassed, en instruction
+_OP_NAME_PASSER_EN_INSTRUCTION = "dossierPasserEnInstruction"
+_NEEDS_MOTIVATION = frozenset((DossierState.ACCEPTE.value, DossierState.REFUSE.value, DossierState.SANS_SUITE.value))
+
 # TODO: Add an interface action which implement a regular perform action method
 # TODO: Annotation : implement general annotation modifier to modify any annotation checkbox, text, etc...
 
@@ -24,6 +41,8 @@ class MessageSender(IAction, ILog):
     r'''
         Class to send message to a dossier
     '''
+    __slots__ = ('encode',)
+
     def __init__(self, profile : Profile, dossier : Dossier, instructeur_id = None, **kwargs):
         r'''
             Parameters
@@ -39,6 +58,8 @@ class MessageSender(IAction, ILog):
         ILog.__init__(self, header="MESSAGE_SENDER", profile=profile, **kwargs)
         IAction.__init__(self, profile, dossier, query_path='./query/send_message.graphql', instructeur_id=instructeur_id)
 
+        self.encode = compile_input_encoder(self.request.get_query(), "dossierEnvoyerMessage", ("dossierId", "instructeurId", "body", "attachment"))
+
     def     perform(self, mess : str, file_uploaded : dict = None) -> bool:
         r'''
             Send a message to the dossier
@@ -70,22 +91,28 @@ class MessageSender(IAction, ILog):
                 otherwise
 
         '''
-        variables = {
-                "dossierId" : self.dossier.get_id(),
+        operation_name, variables = self.__build_input__(mess, file_uploaded)
+        try:
+            resp = self.request.send_request(partial(self.encode, variables))
+        except DemarchesSimpyException as e:
+            self.warning('Message not sent : %s', e.message)
+            return IAction.NETWORK_ERROR
+        return self.__check_result__(resp.json()['data'][operation_name], mess, file_uploaded)
+
+    def __build_input__(self, mess : str, file_uploaded : dict = None) -> tuple[str, dict]:
+        return "dossierEnvoyerMessage", {
+                "dossierId" : self._dossier_id,
                 "instructeurId" : self.instructeur_id,
                 "body" : mess,
                 "attachment" : file_uploaded['signedBlobId'] if file_uploaded != None else None,
         }
-        self.request.add_variable('input',variables)
-        try:
-            resp = self.request.send_request()
-        except DemarchesSimpyException as e:
-            self.warning('Message not sent : '+e.message)
-            return IAction.NETWORK_ERROR
-        if resp.json()['data']['dossierEnvoyerMessage']['errors'] != None:
-            self.warning('Message not sent : '+str(resp.json()['data']['dossierEnvoyerMessage']['errors'][0]['message']))
+
+    def __check_result__(self, result : dict, mess : str, file_uploaded : dict = None) -> int:
+        if result['errors'] != None:
+            self.warning('Message not sent : %s', result['errors'][0]['message'])
             return IAction.REQUEST_ERROR
-        self.info('Message sent to '+str(self.dossier.get_number()))
+        self.dossier.invalidate()
+        self.info('Message sent to %s', self.dossier.get_number())
         return IAction.SUCCESS
     
 class AnnotationModifier(IAction, ILog):
@@ -102,6 +129,8 @@ class AnnotationModifier(IAction, ILog):
             The instructeur id to use to perform the action, if not provided, the profile instructeur id will be used
 
     '''
+    __slots__ = ('input', 'encode')
+
     def __init__(self, profile : Profile, dossier : Dossier, instructeur_id = None, **kwargs):
         r'''
             Parameters
@@ -117,10 +146,12 @@ class AnnotationModifier(IAction, ILog):
         IAction.__init__(self, profile, dossier, instructeur_id=instructeur_id)
 
         self.input = {
-                "dossierId" : self.dossier.get_id(),
+                "dossierId" : self._dossier_id,
                 "instructeurId" : self.instructeur_id,
         }
 
+        self.encode = compile_input_encoder(self.request.get_query(), "dossierModifierAnnotationText", ("dossierId", "instructeurId", "annotationId", "value"))
+
     def perform(self, anotation : dict[str, str], value : str = None) -> int:
         r'''
             Set annotation to the dossier
@@ -155,32 +186,32 @@ class AnnotationModifier(IAction, ILog):
 
 
         '''
-        #Check if anotation is valid
-        if not 'id' in anotation or (not 'stringValue' in anotation and value == None):
-            self.error('Invalid anotation provided : '+str(anotation))
+        operation_name, variables = self.__build_input__(anotation, value)
 
-        self.input['annotationId'] = anotation['id'] 
-        self.input['value'] = anotation['stringValue'] if value == None else value
-
-    
+        try:
+            resp = self.request.send_request(partial(self.encode, variables))
+        except DemarchesSimpyException as e:
+            self.warning('Anotation not set : %s', e.message)
+            return IAction.NETWORK_ERROR
+        return self.__check_result__(resp.json()['data'][operation_name], anotation, value)
 
-        self.request.add_variable('input',self.input)
+    def __build_input__(self, anotation : dict[str, str], value : str = None) -> tuple[str, dict]:
+        #Check if anotation is valid
+        if not (_ANOTATION_KEYS if value == None else _ANOTATION_KEYS_WITH_VALUE) <= anotation.keys():
+            self.error('Invalid anotation provided : %s', anotation)
 
-        custom_body = {
-            "query": self.request.get_query(),
-            "operationName": "dossierModifierAnnotationText",
-            "variables": self.request.get_variables()
+        return "dossierModifierAnnotationText", {
+            **self.input,
+            "annotationId" : anotation['id'],
+            "value" : anotation['stringValue'] if value == None else value,
         }
 
-        try:
-            resp = self.request.send_request(custom_body)
-        except DemarchesSimpyException as e:
-            self.warning('Anotation not set : '+e.message)
-            return IAction.NETWORK_ERROR
-        if not resp.ok:
-            self.warning('Anotation not set : '+resp.json()['errors'][0]['message'])
-            return IAction.ERROR
-        self.info('Anotation set to '+self.dossier.get_id())
+    def __check_result__(self, result : dict, anotation : dict[str, str], value : str = None) -> int:
+        if result['errors'] != None:
+            self.warning('Anotation not set : %s', result['errors'][0]['message'])
+            return IAction.REQUEST_ERROR
+        self.dossier.invalidate()
+        self.info('Anotation set to %s', self._dossier_id)
         return IAction.SUCCESS
 
 class FileUploader(IAction, ILog):
@@ -196,7 +227,8 @@ class FileUploader(IAction, ILog):
             The dossier to upload file to
 
     '''
-    
+    __slots__ = ('files', 'input')
+
     def __init__(self, profile: Profile, dossier: Dossier, **kwargs):
         request_builder = FileUploadRequestBuilder(profile, './query/actions.graphql')
         ILog.__init__(self, header="FILE UPLOADER", profile=profile, **kwargs)
@@ -205,7 +237,7 @@ class FileUploader(IAction, ILog):
         self.files = []
 
         self.input = {
-            "dossierId": self.dossier.get_id(),
+            "dossierId": self._dossier_id,
         }
 
     def get_files_uploaded(self) -> list:
@@ -291,7 +323,7 @@ class FileUploader(IAction, ILog):
         try:
             resp = self.request.send_request(file_path, custom_body=custom_body)
         except DemarchesSimpyException as e:
-            self.warning('File not uploaded : '+e.message)
+            self.warning('File not uploaded : %s', e.message)
             return IAction.NETWORK_ERROR
         self.files.append({'signedBlobId' : resp, 'fileName' : file_name, 'contentType' : file_type})
         return IAction.SUCCESS
@@ -304,6 +336,7 @@ class StateModifier(IAction, ILog):
     r'''
         Class to change state of a dossier
     '''
+    __slots__ = ('input', 'bodies')
 
     def __init__(self, profile : Profile, dossier : Dossier, instructeur_id=None, **kwargs):
         r'''
@@ -323,10 +356,16 @@ class StateModifier(IAction, ILog):
             self.error('No instructeur id was provided to the profile, cannot change state.')
         
         self.input = {
-                "dossierId" : self.dossier.get_id(),
+                "dossierId" : self._dossier_id,
                 "instructeurId" : self.instructeur_id,
         }
 
+        # One body per mutation of the query, perform only adds the variables
+        self.bodies = {
+            operation_name : {"query" : self.request.get_query(), "operationName" : operation_name}
+            for operation_name in parse_mutations(self.request.get_query())
+        }
+
 
     def perform(self, state: DossierState, msg="") -> int:
         r'''
@@ -341,29 +380,135 @@ class StateModifier(IAction, ILog):
 
         '''
 
-        if state == DossierState.ACCEPTE or state == DossierState.REFUSE or state == DossierState.SANS_SUITE:
-            self.input['motivation'] = msg
+        operation_name, variables = self.__build_input__(state, msg)
+        custom_body = {**self.bodies[operation_name], "variables" : {"input" : variables}}
+        try:
+            resp = self.request.send_request(custom_body)
+        except DemarchesSimpyException as e:
+            self.warning('State not changed : %s', e.message)
+            return IAction.NETWORK_ERROR
+        return self.__check_result__(resp.json()['data'][operation_name], state, msg)
+
+    def __build_input__(self, state: DossierState, msg="") -> tuple[str, dict]:
+        key = str(state)
+        operation_name = _OP_NAMES.get(key)
+        if operation_name is None:
+            self.error('Unknown state %s', state)
+        if key == DossierState.INSTRUCTION.value and self.dossier.get_dossier_state() == 'en_construction':
+            operation_name = _OP_NAME_PASSER_EN_INSTRUCTION
+
+        variables = dict(self.input)
+        if key in _NEEDS_MOTIVATION:
+            variables['motivation'] = msg
+        return operation_name, variables
+
+    def __check_result__(self, result : dict, state : DossierState, msg="") -> int:
+        if result['errors'] != None:
+            self.warning('State not changed : %s', result['errors'][0]['message'])
+            return IAction.REQUEST_ERROR
+        self.dossier.invalidate()
+        self.info('State changed to %s for %s', state, self._dossier_id)
+        return IAction.SUCCESS
 
-        self.request.add_variable('input',self.input)
-        operation_name = "dossier"
-        operation_name += ("Passer" if (state == DossierState.INSTRUCTION and self.dossier.get_dossier_state() == 'en_construction') else "")
-        operation_name += ("Repasser" if (state == DossierState.INSTRUCTION and self.dossier.get_dossier_state() != 'en_construction') else "")
-        operation_name += ("Repasser" if state == DossierState.CONSTRUCTION else "")
-        operation_name += DossierState.__build_query_suffix__(state)
 
 
-        custom_body = {
-            "query" : self.request.get_query(),
-            "operationName" : operation_name,
-            "variables" : self.request.get_variables()
+class ActionBatch(ILog):
+    r'''
+        Class to send several actions in a single request
+
+        Each action added to the batch becomes an aliased mutation of one graphql document, the whole
+        document is sent when :func:`flush` is called. Only actions that implement the batch protocol
+        (:class:`MessageSender`, :class:`AnnotationModifier` and :class:`StateModifier`) can be added.
+
+        .. highlight:: python
+        .. code-block:: python
+
+            batch = ActionBatch(profile)
+            for dossier in dossiers:
+                batch.add(AnnotationModifier(profile, dossier), annotation, 'new value')
+            results = batch.flush()
+
+    '''
+    def __init__(self, profile : Profile, **kwargs):
+        r'''
+            Parameters
+            ----------
+            profile : Profile
+                The profile to use to send the batch
+        '''
+        ILog.__init__(self, header="ACTION BATCH", profile=profile, **kwargs)
+        self.profile = profile
+        self.request = RequestBuilder(profile, './query/empty.graphql')
+        self.actions = []
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def add(self, action : IAction, *args, **kwargs) -> 'ActionBatch':
+        r'''
+            Queue an action, nothing is sent until :func:`flush` is called
+
+            Parameters
+            ----------
+            action : IAction
+                The action to queue
+            *args, **kwargs
+                The arguments that would be given to the perform method of the action
+
+            Returns
+            -------
+                The batch itself
+        '''
+        if not hasattr(action, '__build_input__'):
+            self.error('%s cannot be batched', type(action).__name__)
+        operation_name, variables = action.__build_input__(*args, **kwargs)
+        self.actions.append((action, operation_name, variables, args, kwargs))
+        return self
+
+    def __build_body__(self, actions : list) -> dict:
+        declarations, fields, variables = [], [], {}
+        for i, (action, operation_name, input, _, _) in enumerate(actions):
+            input_type, selection = action.request.get_mutation(operation_name)
+            declarations.append(f"$i{i}: {input_type}")
+            fields.append(f"a{i}: {operation_name}(input: $i{i}) {selection}")
+            variables[f"i{i}"] = input
+        return {
+            "query" : "mutation batch(" + ", ".join(declarations) + ") {\n" + "\n".join(fields) + "\n}",
+            "operationName" : "batch",
+            "variables" : variables
         }
+
+    def flush(self) -> list[int]:
+        r'''
+            Send all queued actions in one request and empty the batch
+
+            Returns
+            -------
+                The result code of each action (see :func:`IAction.perform`) in the order they were added
+        '''
+        if len(self.actions) == 0:
+            return []
+        actions, self.actions = self.actions, []
         try:
-            resp = self.request.send_request(custom_body)
+            # Other mutations of the batch are applied even if some fail, their results are still returned.
+            # The document is built for this batch only, persisting it would cost a second round trip
+            resp = self.request.send_request(self.__build_body__(actions), allow_partial=True, apq=False)
         except DemarchesSimpyException as e:
-            self.warning('State not changed : '+e.message)
-            return IAction.NETWORK_ERROR
-        if resp.json()['data'][operation_name]['errors'] != None:
-            self.warning('State not changed : '+resp.json()['data'][operation_name]['errors'][0]['message'])
-            return IAction.REQUEST_ERROR
-        self.info('State changed to '+str(state)+' for '+self.dossier.get_id())
-        return IAction.SUCCESS
\ No newline at end of file
+            self.warning('Batch not sent : %s', e.message)
+            return [IAction.NETWORK_ERROR] * len(actions)
+        content = resp.json()
+        data = content['data']
+        errors = content.get('errors') or []
+        failed = {error['path'][0] for error in errors if error.get('path')}
+        self.debug('Batch of %d actions sent', len(actions))
+
+        results = []
+        for i, (action, _, _, args, kwargs) in enumerate(actions):
+            alias = f"a{i}"
+            if data.get(alias) is None or alias in failed:
+                message = next((error['message'] for error in errors if error.get('path') and error['path'][0] == alias), 'no result')
+                action.warning('Action not performed : %s', message)
+                results.append(IAction.REQUEST_ERROR)
+            else:
+                results.append(action.__check_result__(data[alias], *args, **kwargs))
+        return results
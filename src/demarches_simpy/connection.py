@@ -1,22 +1,232 @@
 from pathlib import Path
+import re
+import time
+import gzip
+import hashlib
+from threading import Lock
+from functools import lru_cache
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import requests
 import json
 from requests import Response 
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from email.utils import parsedate_to_datetime
 from .interfaces import ILog
+from .utils import retry_on_status
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import httpx
+    # Needed by httpx to speak HTTP/2
+    import h2
+except ImportError:
+    httpx = None
+
+
+def json_dumps(value, sort_keys : bool = False) -> bytes:
+    r'''
+    Encode a value to JSON bytes, with orjson if it is installed, with the standard json module otherwise
+    '''
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(value, sort_keys=sort_keys, separators=(',', ':')).encode()
+
+def json_loads(content):
+    r'''
+    Decode JSON bytes or string, with orjson if it is installed, with the standard json module otherwise
+    '''
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class ResponseCache():
+    r'''
+    In-memory cache of the responses of read queries, shared by all objects of a profile.
+
+    Responses are stored under the sha256 of the request body (query and variables), so the same
+    query with the same variables is sent only once until the entry expires or is invalidated.
+    '''
+    def __init__(self, ttl : float) -> None:
+        r'''
+        Parameters
+        ----------
+        ttl : float
+            The default time (in seconds) a response is kept
+        '''
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def key(body) -> str:
+        r'''
+        Parameters
+        ----------
+        body : dict or bytes
+            The request body, bytes bodies are hashed as they are
+
+        Returns
+        -------
+            The cache key of a request body
+        '''
+        if isinstance(body, bytes):
+            return hashlib.sha256(body).hexdigest()
+        return hashlib.sha256(json_dumps(body, sort_keys=True)).hexdigest()
+
+    def get(self, key : str) -> Response:
+        r'''
+        Returns
+        -------
+        Response
+            The cached response
+        None
+            if there is no entry for this key or if it has expired
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key : str, response : Response, ttl : float = None) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), response)
+
+    def invalidate(self, key : str) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+class Http2Session():
+    r'''
+    Minimal replacement of :class:`requests.Session` sending the requests over HTTP/2 with httpx, used by
+    :class:`Profile` when http2=True. All requests share one multiplexed connection to démarches simplifiées.
+
+    Responses are converted to :class:`requests.Response` so the rest of the package is unchanged.
+    '''
+    def __init__(self, client) -> None:
+        r'''
+        Parameters
+        ----------
+        client : httpx.Client
+            The client sending the requests, it is closed with the session
+        '''
+        self.client = client
+
+    @staticmethod
+    def __to_response__(resp) -> Response:
+        response = Response()
+        response.status_code = resp.status_code
+        response.reason = resp.reason_phrase
+        response.headers = CaseInsensitiveDict(resp.headers)
+        response.url = str(resp.url)
+        response.encoding = resp.encoding
+        # httpx already decoded the content
+        response._content = resp.content
+        return response
+
+    def post(self, url : str, data : bytes = None, headers : dict = None) -> Response:
+        return Http2Session.__to_response__(self.client.post(url, content=data, headers=headers))
+
+    def put(self, url : str, data = None, headers : dict = None) -> Response:
+        if hasattr(data, 'read'):
+            data = data.read()
+        return Http2Session.__to_response__(self.client.put(url, content=data, headers=headers))
+
+    def close(self) -> None:
+        self.client.close()
+
 
 class Profile(ILog):
     r'''
     The profile class handling connection information and can allow you to pass configuration parameters and diffuse it to all object using this profile
 
     - Exemple : Passing the args verbose=True will activate the verbose to all object using this profile instance.
+
+    - Exemple : Passing the args max_workers=32 will allow up to 32 asynchronous requests (see :func:`IAction.perform_async`) to run concurrently.
+
+    - Exemple : Passing the args cache_ttl=300 will keep the responses of read queries (dossiers, demarches, fields) during 5 minutes, see :class:`ResponseCache`.
+
+    - Exemple : Passing the args max_retries=0 will disable the retries of requests refused by an overloaded server (default : 4 retries).
+
+    - Exemple : Passing the args apq=True will send automatic persisted queries (only the sha256 of the query), only enable it if the server supports them.
+
+    - Exemple : Passing the args compression=True will gzip the request bodies bigger than 4 KB (batches of actions for instance), only enable it if the server accepts compressed requests.
+      Responses are always requested compressed.
+
+    - Exemple : Passing the args http2=True will send all requests over a single HTTP/2 connection, it requires httpx (pip install demarches-simpy[http2]).
     '''
     def __init__(self, api_key : str, instructeur_id : str = None, **kwargs) -> None:
         super().__init__(header='PROFILE', profile=None, **kwargs)
         self.api_key = api_key
         self.instructeur_id = instructeur_id
 
+        self.max_workers = kwargs.get('max_workers', 16)
+        self.executor = None
+        self._session = None
+        self.cache = ResponseCache(kwargs['cache_ttl']) if kwargs.get('cache_ttl') else None
+        self.max_retries = kwargs.get('max_retries', 4)
+        self.apq = kwargs.get('apq', False)
+        self.compression = kwargs.get('compression', False)
+        self.http2 = kwargs.get('http2', False)
+        if self.http2 and httpx is None:
+            self.error('httpx is required to use http2, install it with : pip install demarches-simpy[http2]')
+
         self.debug('Profile class created')
 
+    def get_executor(self) -> ThreadPoolExecutor:
+        r'''
+        Returns
+        -------
+        ThreadPoolExecutor
+            The executor shared by all asynchronous requests of this profile, created on first use
+        '''
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='demarches-simpy')
+        return self.executor
+
+    @property
+    def session(self) -> requests.Session:
+        r'''
+        The HTTP session shared by all requests of this profile, created on first use.
+        Connections to démarches simplifiées are kept alive and reused from one request to another.
+        With http2=True, it is a :class:`Http2Session`.
+        '''
+        if self._session is None and self.http2:
+            limits = httpx.Limits(max_connections=50, max_keepalive_connections=50)
+            self._session = Http2Session(httpx.Client(http2=True, limits=limits))
+        elif self._session is None:
+            adapter = HTTPAdapter(pool_maxsize=max(self.max_workers, 10))
+            self._session = requests.Session()
+            self._session.mount('https://', adapter)
+        return self._session
+
+    def close(self) -> None:
+        r'''
+        Release the resources held by the profile (asynchronous workers and open connections), the profile can still be used afterwards
+        '''
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
 
     ## GETTERS
     def get_api_key(self) -> str:
@@ -68,22 +278,168 @@ class Profile(ILog):
 
 
 
+@lru_cache(maxsize=None)
+def load_query(graph_ql_query_path : str) -> str:
+    r'''
+    Read a graphql file of the package, each file is read only once per process
+
+    Parameters
+    ----------
+    graph_ql_query_path : str
+        The path of the file relative to the package directory
+    '''
+    with open(Path(__file__).parent / graph_ql_query_path, 'r') as f:
+        return f.read()
+
+
+_MUTATION_HEAD = re.compile(r'mutation\s+(\w+)\s*\(\s*\$input\s*:\s*([\w!]+)\s*\)\s*\{\s*(\w+)\s*\(\s*input\s*:\s*\$input\s*\)\s*\{')
+
+@lru_cache(maxsize=None)
+def parse_mutations(query : str) -> dict[str, tuple[str, str]]:
+    r'''
+    Split a graphql document made of single-input mutations
+
+    Parameters
+    ----------
+    query : str
+        A graphql document where each operation has the shape ``mutation name($input: Type!) { field(input: $input) { ... } }``
+
+    Returns
+    -------
+        A dict with the operation name as key and a tuple (input type, selection set of the mutation field) as value
+    '''
+    mutations = {}
+    for match in _MUTATION_HEAD.finditer(query):
+        # Walk the braces to find the end of the field selection set
+        depth, end = 1, match.end()
+        while depth > 0:
+            depth += {'{' : 1, '}' : -1}.get(query[end], 0)
+            end += 1
+        mutations[match.group(1)] = (match.group(2), query[match.end() - 1:end])
+    return mutations
+
+
+def parse_retry_after(value : str) -> float:
+    r'''
+    Returns
+    -------
+    float
+        The delay in seconds of a Retry-After header (given in seconds or as an HTTP date)
+    None
+        if the header is missing or malformed
+    '''
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Automatic persisted query modes : send only the hash of the query, or the query with its hash so the server stores it
+APQ_HASH = 'hash'
+APQ_REGISTER = 'register'
+
+@lru_cache(maxsize=None)
+def query_hash(query : str) -> str:
+    r'''
+    Returns
+    -------
+        The sha256 of a graphql document, as used by automatic persisted queries
+    '''
+    return hashlib.sha256(query.encode()).hexdigest()
+
+def query_fields(query : str, apq : str = None) -> dict:
+    r'''
+    Parameters
+    ----------
+    query : str
+        The graphql document
+    apq : str, optional
+        None to send the query, APQ_HASH to send only its hash, APQ_REGISTER to send both
+
+    Returns
+    -------
+        The fields identifying the query in a request body
+    '''
+    if apq is None:
+        return {"query" : query}
+    extensions = {"persistedQuery" : {"version" : 1, "sha256Hash" : query_hash(query)}}
+    if apq == APQ_HASH:
+        return {"extensions" : extensions}
+    return {"query" : query, "extensions" : extensions}
+
+
+@lru_cache(maxsize=None)
+def compile_input_encoder(query : str, operation_name : str, keys : tuple[str, ...]) -> Callable[..., bytes]:
+    r'''
+    Build a function encoding the request body of a single-input mutation
+
+    The JSON text around the input values is produced once per process, the returned function only encodes the values
+    and formats them into it, so it is shared by all actions calling the same mutation.
+
+    Parameters
+    ----------
+    query : str
+        The graphql document containing the mutation
+    operation_name : str
+        The mutation to call
+    keys : tuple[str, ...]
+        The keys of the input, in the order they are written
+
+    Returns
+    -------
+        A function taking the input dict (and optionally the persisted query mode, see :func:`query_fields`) and
+        returning the encoded body, inputs with other keys than the expected ones are encoded the generic way
+    '''
+    escape = lambda text : text.replace(b'%', b'%%')
+    input_template = b',"variables":{"input":{' + b','.join(escape(json_dumps(key)) + b':%s' for key in keys) + b'}}}'
+    templates = {
+        apq : escape(json_dumps({**query_fields(query, apq), "operationName" : operation_name})[:-1]) + input_template
+        for apq in (None, APQ_HASH, APQ_REGISTER)
+    }
+    expected = frozenset(keys)
+
+    def encode(input : dict, apq : str = None) -> bytes:
+        if input.keys() != expected:
+            return json_dumps({**query_fields(query, apq), "operationName" : operation_name, "variables" : {"input" : input}})
+        return templates[apq] % tuple(json_dumps(input[key]) for key in keys)
+    return encode
+
+
 class RequestBuilder(ILog):
     r'''
     Internal class handling request and fetching data from démarches simplifiées, you won't have to use (except for dev)
+
+    If the builder is cacheable and the profile has a :class:`ResponseCache`, responses are served from the cache when possible.
     '''
+    cacheable = False
+
+    # The server did not process the request, it can always be sent again
+    RETRY_STATUSES = (429, 503)
+    # The request may have been processed, only read queries are sent again
+    RETRY_READ_STATUSES = (429, 502, 503, 504)
+
+    # Smaller bodies are not worth compressing
+    COMPRESSION_THRESHOLD = 4096
 
     def __init__(self, profile : Profile, graph_ql_query_path : str, **kwargs) -> None:
         super().__init__(header='REQUEST BUILDER', profile=profile, **kwargs)
         self.profile = profile
         self.variables = {}
+        self.cache_keys = set()
+        # Requests of a builder can be sent from the profile executor while the builder is invalidated
+        self.cache_keys_lock = Lock()
         try:
-            path = Path(__file__).parent / graph_ql_query_path
-            self.query = open(path, 'r').read()
+            self.query = load_query(graph_ql_query_path)
         except:
-            self.error('Cannot open file '+graph_ql_query_path)
+            self.error('Cannot open file %s', graph_ql_query_path)
         
-        self.debug('RequestBuilder class created from '+graph_ql_query_path)
+        self.debug('RequestBuilder class created from %s', graph_ql_query_path)
 
     def __get_body__(self) -> dict:
         return {
@@ -99,6 +455,16 @@ class RequestBuilder(ILog):
     
     def get_query(self) -> str:
         return self.query
+    def get_mutation(self, operation_name : str) -> tuple[str, str]:
+        r'''
+        Returns
+        -------
+            The input type and the selection set of a mutation of the query, see :func:`parse_mutations`
+        '''
+        mutations = parse_mutations(self.query)
+        if operation_name not in mutations:
+            self.error('Unknown mutation %s', operation_name)
+        return mutations[operation_name]
     def get_variables(self) -> dict:
         return self.variables
 
@@ -109,16 +475,92 @@ class RequestBuilder(ILog):
     def is_variable_set(self, key : str) -> bool:
         return key in self.variables
 
-    def send_request(self, custom_body=None) -> Response:
-        resp = requests.post(
+    def __encode__(self, body, apq : str = None) -> bytes:
+        if callable(body):
+            return body(apq=apq)
+        if isinstance(body, bytes):
+            return body
+        if apq is not None and 'query' in body:
+            body = {**{k : v for k, v in body.items() if k != 'query'}, **query_fields(body['query'], apq)}
+        return json_dumps(body)
+
+    def send_request(self, custom_body=None, allow_partial : bool = False, apq : bool = True) -> Response:
+        r'''
+        Send the request and return the response
+
+        Parameters
+        ----------
+        custom_body : dict or bytes or callable, optional
+            The body to send instead of the one built from the query and the variables. bytes are sent as they are,
+            a callable (such as the functions built by :func:`compile_input_encoder`) is given the persisted query mode
+            and returns the encoded body.
+        allow_partial : bool, optional
+            If True, a response with errors is still returned when it carries data, as some fields of the
+            query may have been resolved (default : False)
+        apq : bool, optional
+            If False, the query is always sent in full even if the profile uses automatic persisted queries,
+            for documents built on the fly that would hardly ever be found on the server (default : True)
+        '''
+        body = self.__get_body__() if custom_body == None else custom_body
+        cache = self.profile.cache if self.cacheable and not callable(body) else None
+        if cache is not None:
+            key = ResponseCache.key(body)
+            with self.cache_keys_lock:
+                self.cache_keys.add(key)
+            resp = cache.get(key)
+            if resp is not None:
+                self.debug('Response served from cache')
+                return resp
+
+        statuses = RequestBuilder.RETRY_READ_STATUSES if self.cacheable else RequestBuilder.RETRY_STATUSES
+        post = retry_on_status(statuses, tries=self.profile.max_retries + 1)(self.__post__)
+        apq = APQ_HASH if apq and self.profile.apq and not isinstance(body, bytes) else None
+        resp = post(self.__encode__(body, apq))
+        content = resp.json()
+        if apq is not None and content.get('errors') and content['errors'][0]['message'] == 'PersistedQueryNotFound':
+            self.debug('Persisted query not found, sending the query')
+            resp = post(self.__encode__(body, APQ_REGISTER))
+            content = resp.json()
+        if 'errors' in content and content['errors'] != None and not (allow_partial and content.get('data')):
+            self.error('Request not sent : %s', content['errors'][0]['message'])
+        if cache is not None and resp.ok:
+            cache.put(key, resp)
+        return resp
+
+    def __post__(self, data : bytes) -> Response:
+        headers = self.__get_header__()
+        if self.profile.compression and len(data) > RequestBuilder.COMPRESSION_THRESHOLD:
+            data = gzip.compress(data, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+        resp = self.profile.session.post(
             self.profile.get_url(),
-            json = self.__get_body__() if custom_body == None else custom_body,
-            headers = self.__get_header__()
+            data = data,
+            headers = headers
         )
-        if 'errors' in resp.json() and resp.json()['errors'] != None: 
-            self.error('Request not sent : '+resp.json()['errors'][0]['message'])
-        else:
-            return resp
+        if resp.status_code in RequestBuilder.RETRY_READ_STATUSES:
+            self.error('Server unavailable : %s', resp.status_code, status_code=resp.status_code, retry_after=parse_retry_after(resp.headers.get('Retry-After')))
+        if orjson is not None:
+            resp.json = lambda **kwargs : orjson.loads(resp.content)
+        return resp
+
+    def invalidate(self) -> None:
+        r'''
+        Remove from the profile cache all responses of requests sent by this builder
+        '''
+        with self.cache_keys_lock:
+            keys = list(self.cache_keys)
+            self.cache_keys.clear()
+        if self.profile.cache is not None:
+            for key in keys:
+                self.profile.cache.invalidate(key)
+
+    async def send_request_async(self, custom_body=None) -> Response:
+        r'''
+        Same as :func:`send_request` but awaitable, the request is sent from the profile executor
+        so that several requests can be in flight at the same time.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.profile.get_executor(), self.send_request, custom_body)
 
 
 class FileUploadRequestBuilder(RequestBuilder):
@@ -126,25 +568,27 @@ class FileUploadRequestBuilder(RequestBuilder):
     def send_request(self, file_path, custom_body=None) -> Response:
         resp = super().send_request(custom_body)
 
-        if 'errors' in resp.json() and resp.json()['errors'] != None:
-            self.error('Message not sent : '+resp.json()['errors'][0]['message'])
+        content = resp.json()
+        if 'errors' in content and content['errors'] != None:
+            self.error('Message not sent : %s', content['errors'][0]['message'])
         
         if resp.ok:
             self.debug('File upload request sent')
         else:
-            self.error('File upload request not sent : '+str(resp.status_code)+'\n'+resp.text)
+            self.error('File upload request not sent : %s\n%s', resp.status_code, resp.text)
 
         #Upload file 
-        info = resp.json()['data']['createDirectUpload']['directUpload']
+        info = content['data']['createDirectUpload']['directUpload']
         url = info['url']
-        headers = json.loads(info['headers'])
+        headers = json_loads(info['headers'])
 
-        upload_resp = requests.put(url, data=open(file_path, 'rb'), headers=headers)
+        with open(file_path, 'rb') as f:
+            upload_resp = self.profile.session.put(url, data=f, headers=headers)
 
 
         if upload_resp.ok:
             self.debug('File uploaded')
         else:
-            self.error("\nCode error : "+str(upload_resp.status_code)+"\n"+ upload_resp.text)
+            self.error("\nCode error : %s\n%s", upload_resp.status_code, upload_resp.text)
 
         return info['signedBlobId']
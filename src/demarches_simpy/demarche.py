@@ -3,7 +3,8 @@ from __future__ import annotations
 from .interfaces import IData, ILog
 from .connection import RequestBuilder
 
-from typing import TYPE_CHECKING, Callable
+from typing import TYPE_CHECKING, Callable, Iterator
+from itertools import islice, chain
 
 
 if TYPE_CHECKING:
@@ -21,9 +22,16 @@ class Demarche(IData,ILog):
 
     Request Variables (For fetching)
     --------------------------------
+        - includeDossiers -> For the first page of dossiers (default : True)
         - includeRevision -> For fields and annotations
         - includeInstructeurs -> For instructeurs info
+
+    Pages of dossiers are fetched apart from the demarche data and only contain the id and number of each dossier.
+    While a page is being used, the next one is already fetched in background.
     '''
+    __slots__ = ('_id', '_number', 'dossiers', '_dossier_nodes', '_has_next_page', '_cursor', '_next_page',
+                 'fields', 'annotations', 'instructeurs', '_instructeurs_by_email')
+
     def __init__(self, number : int, profile : Profile, id : str = None,**kwargs) :
         # Building the request
         request = RequestBuilder(profile, './query/demarche.graphql')
@@ -41,18 +49,70 @@ class Demarche(IData,ILog):
 
         
     def __init_cache__(self):
+        # A prefetch already running is left to finish, its page is ignored
+        pending = getattr(self, '_next_page', None)
+        if pending is not None:
+            pending.cancel()
         self.dossiers = []
+        self._dossier_nodes = []
+        self._has_next_page = True
+        self._cursor = None
+        self._next_page = None
         self.fields = None
         self.annotations = None
+        self.instructeurs = None
+        self._instructeurs_by_email = None
+
+    def __next_dossier_page__(self, wanted : int = 0) -> bool:
+        r'''
+            Add the next page of dossiers to the (id, number) cache
+
+            Parameters
+            ----------
+                wanted : int, optional
+                    The number of dossiers the caller needs, -1 for all. The following page is fetched in background
+                    only while fewer dossiers are known (default : 0, no prefetch)
 
-    def __next_dossier_cursor__(self, background_fetching : bool = False, **dossier_kwargs) -> bool:
+            Returns
+            -------
+                False if all pages were already retrieved, True otherwise
+        '''
+        if not self._has_next_page:
+            return False
+        if self._next_page is not None:
+            future, self._next_page = self._next_page, None
+            try:
+                response = future.result()
+            except Exception:
+                # The prefetch failed, the page is fetched again so the error is raised here if it persists
+                response = self.__fetch_dossier_page__(self._cursor)
+            dossiers = response.json()['data']['demarche']['dossiers']
+        elif self._cursor is None and self.has_been_fetched and self.data['demarche'].get('dossiers') is not None:
+            # The first page came with the demarche data
+            dossiers = self.data['demarche']['dossiers']
+        else:
+            dossiers = self.__fetch_dossier_page__(self._cursor).json()['data']['demarche']['dossiers']
+        self._dossier_nodes.extend((node['id'], node['number']) for node in dossiers['nodes'])
+        self._has_next_page = dossiers['pageInfo']['hasNextPage']
+        self._cursor = dossiers['pageInfo']['endCursor']
+        if self._has_next_page and (wanted == -1 or len(self._dossier_nodes) < wanted):
+            self._next_page = self._profile.get_executor().submit(self.__fetch_dossier_page__, self._cursor)
+        return True
+
+    def __fetch_dossier_page__(self, cursor : str):
+        # Only the dossiers are selected, whatever include flags the demarche request has
+        response = self.request.send_request({
+            "query" : self.request.get_query(),
+            "variables" : {"demarcheNumber" : self.number, "cursor" : cursor}
+        })
+        if response.status_code != 200:
+            self.error("Could not fetch dossiers : %s", response.status_code)
+        return response
+
+    def __build_dossiers__(self, count : int, background_fetching : bool = False, **dossier_kwargs) -> None:
         from .dossier import Dossier
-        for node in self.get_data()['demarche']['dossiers']['nodes']:
-            self.dossiers.append(Dossier(node['number'], self._profile, node['id'], background_fetching=background_fetching, **dossier_kwargs))
-        self.request.add_variable('cursor', self.get_data()['demarche']['dossiers']['pageInfo']['endCursor'])
-        has_next = self.get_data()['demarche']['dossiers']['pageInfo']['hasNextPage']
-        self.has_been_fetched = False # Not force_fetch otherwise it would erase the dossiers cache /!\
-        return has_next
+        for id, number in self._dossier_nodes[len(self.dossiers):count]:
+            self.dossiers.append(Dossier(number, self._profile, id, background_fetching=background_fetching, **dossier_kwargs))
     
 
 
@@ -104,12 +164,9 @@ class Demarche(IData,ILog):
                 
         '''
 
-        while self.__next_dossier_cursor__():
-            if len(self.dossiers) > limit and limit != -1:
-                return list(map(lambda d : (d.id, d.number), self.dossiers[:limit]))
-            elif len(self.dossiers) == limit and limit != -1:
-                return list(map(lambda d : (d.id, d.number), self.dossiers))
-        return list(map(lambda d : (d.id, d.number), self.dossiers))
+        while (limit == -1 or len(self._dossier_nodes) < limit) and self.__next_dossier_page__(limit):
+            pass
+        return self._dossier_nodes[:] if limit == -1 else self._dossier_nodes[:limit]
    
     def get_dossiers_count(self) -> int:
         r'''
@@ -117,7 +174,9 @@ class Demarche(IData,ILog):
         -------
             The total dossier count
         '''
-        return len(self.get_dossier_infos(limit=-1))
+        while self.__next_dossier_page__(-1):
+            pass
+        return len(self._dossier_nodes)
     
     def get_dossiers(self, limit : int = 100, dossier_filter : Callable[[Dossier],bool] = lambda _ : True, background_fetching : bool = False, **dossier_kwargs) -> list[Dossier]:
         r'''
@@ -143,23 +202,50 @@ class Demarche(IData,ILog):
                 This method will fetch all dossiers, if you want to filter them, use the dossier_filter parameter, by default dossier object contains only number and id,
                 if you want filter them by other fields, you need to set background_fetching to True, this will fetch all fields of all dossiers while fetching them avoiding
                 synchronous fetching of each dossier.
+
+            See Also
+            --------
+                iter_dossiers
         '''
 
 
 
 
-        while self.__next_dossier_cursor__(background_fetching=background_fetching, **dossier_kwargs):
-            filtered = list(filter(dossier_filter, self.dossiers))
-            if len(filtered) > limit and limit != -1:
-                return filtered[:limit]
-            elif len(filtered) == limit and limit != -1:
-                return filtered
-        return list(filter(dossier_filter, self.dossiers))
+        iterator = self.iter_dossiers(dossier_filter, background_fetching, **dossier_kwargs)
+        return list(iterator) if limit == -1 else list(islice(iterator, limit))
 
+    def iter_dossiers(self, dossier_filter : Callable[[Dossier],bool] = lambda _ : True, background_fetching : bool = False, **dossier_kwargs) -> Iterator[Dossier]:
+        r'''
+            Iterate over the dossier objects, pages of dossiers are fetched only when the iteration reaches them
 
-            
-        
-        
+            Parameters
+            ----------
+                dossier_filter : Callable[[Dossier],bool], optional
+                    Only dossiers for which the function returns True are yielded (default : lambda _ : True)
+                background_fetching : bool, optional
+                    If set to True, all dossiers of a page are created (and start fetching their data) as soon as the page is retrieved,
+                    otherwise each dossier is created when the iteration reaches it (default : False)
+                dossier_kwargs : dict, optional
+                    A dict of kwargs that will be passed to the dossier constructor
+
+            Returns
+            -------
+                An iterator over the dossiers
+
+            Notes
+            -----
+                Dossier objects are shared with :func:`get_dossiers`, breaking the loop early avoids fetching the remaining pages.
+        '''
+        index = 0
+        while True:
+            while index < len(self._dossier_nodes):
+                self.__build_dossiers__(len(self._dossier_nodes) if background_fetching else index + 1, background_fetching=background_fetching, **dossier_kwargs)
+                dossier = self.dossiers[index]
+                index += 1
+                if dossier_filter(dossier):
+                    yield dossier
+            if not self.__next_dossier_page__(-1):
+                return
 
     #Champs retrieve
     def get_fields(self) -> dict[str,dict[str,str]]:
@@ -186,6 +272,7 @@ class Demarche(IData,ILog):
         '''
         if self.fields == None:
             self.request.add_variable('includeRevision', True)
+            self.request.add_variable('includeDossiers', False)
             raw = self.force_fetch().get_data()['demarche']['activeRevision']['champDescriptors']    
             self.fields = dict(map(lambda x : (x['label'],x),raw))
         return self.fields
@@ -213,22 +300,44 @@ class Demarche(IData,ILog):
         '''
         if self.annotations == None:
             self.request.add_variable('includeRevision', True)
+            self.request.add_variable('includeDossiers', False)
             raw = self.force_fetch().get_data()['demarche']['activeRevision']['annotationDescriptors']    
             self.annotations = dict(map(lambda x : (x['label'],x),raw))
         return self.annotations
     #TODO: Make a whole object for instructeurs
-    def get_instructeurs_info(self):
-        if not self.request.is_variable_set('includeInstructeurs'):
-            self.request.add_variable('includeInstructeurs', True)
-            self.request.add_variable('includeGroupeInstructeurs', True)
-            groupes = self.force_fetch().get_data()['demarche']['groupeInstructeurs']
-            instructeurs = []
-            for groupe in groupes:
-                for instructeur in groupe['instructeurs']:
-                    instructeurs.append(instructeur)
-            self.instructeurs = instructeurs
+    def get_instructeurs_info(self) -> list[dict[str,str]]:
+        r'''
+            Get the instructeurs of all groupes of the demarche
+
+            Returns
+            -------
+                A list of dict, each dict contains two keys : id and email
+        '''
+        if self.instructeurs is None:
+            if not self.request.is_variable_set('includeInstructeurs'):
+                self.request.add_variable('includeInstructeurs', True)
+                self.request.add_variable('includeGroupeInstructeurs', True)
+                self.request.add_variable('includeDossiers', False)
+                self.force_fetch()
+            groupes = self.get_data()['demarche']['groupeInstructeurs']
+            self.instructeurs = list(chain.from_iterable(groupe['instructeurs'] for groupe in groupes))
         return self.instructeurs
 
+    def get_instructeur_by_email(self, email : str) -> dict[str,str]:
+        r'''
+            Get an instructeur of the demarche from its email
+
+            Returns
+            -------
+            dict
+                The instructeur info (id and email)
+            None
+                If no instructeur of the demarche has this email
+        '''
+        if self._instructeurs_by_email is None:
+            self._instructeurs_by_email = {instructeur['email'] : instructeur for instructeur in self.get_instructeurs_info()}
+        return self._instructeurs_by_email.get(email)
+
 
         ''''''
 
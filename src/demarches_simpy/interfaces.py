@@ -1,5 +1,7 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
+from functools import partial
+import asyncio
 if TYPE_CHECKING:
     from .connection import Profile
     from .dossier import Dossier
@@ -11,6 +13,8 @@ from .utils import bcolors, DemarchesSimpyException
 
 
 class ILog():
+    __slots__ = ('header', 'verbose', 'displaying_warning')
+
     def __init__(self, header, profile, **kwargs):
         self.header = header
 
@@ -51,31 +55,33 @@ class ILog():
         return self.displaying_warning
 
 
-    def info(self, msg):
+    @staticmethod
+    def __render__(msg, args):
         msg = str(msg)
-        print(f"{bcolors.OKGREEN}[{self.header}] {msg}{bcolors.ENDC}") 
+        return msg % args if args else msg
 
-    def error(self, msg):
-        msg = str(msg)
-        raise DemarchesSimpyException(header=self.header, message=msg)
+    def info(self, msg, *args):
+        print(f"{bcolors.OKGREEN}[{self.header}] {ILog.__render__(msg, args)}{bcolors.ENDC}") 
 
-    def warning(self, msg):
+    def error(self, msg, *args, **kwargs):
+        raise DemarchesSimpyException(header=self.header, message=ILog.__render__(msg, args), **kwargs)
+
+    def warning(self, msg, *args):
         if not self.displaying_warning:
             return
-        msg = str(msg)
-        print(f"{bcolors.WARNING}[{self.header}] {msg}{bcolors.ENDC}")
+        print(f"{bcolors.WARNING}[{self.header}] {ILog.__render__(msg, args)}{bcolors.ENDC}")
 
-    def debug(self, msg):
+    def debug(self, msg, *args):
         if not self.verbose:
             return
-        msg = str(msg)
-        print(f"{bcolors.OKBLUE}[{self.header}] {msg}{bcolors.ENDC}")
+        print(f"{bcolors.OKBLUE}[{self.header}] {ILog.__render__(msg, args)}{bcolors.ENDC}")
 
-    def bold(self, msg):
-        msg = str(msg)
-        print(f"{bcolors.BOLD}[{self.header}] {msg}{bcolors.ENDC}") 
+    def bold(self, msg, *args):
+        print(f"{bcolors.BOLD}[{self.header}] {ILog.__render__(msg, args)}{bcolors.ENDC}") 
 
 class IAction(ILog):
+    __slots__ = ('profile', 'dossier', '_dossier_id', 'query_path', '__instructeur_id', 'request')
+
     SUCCESS = 0
     NETWORK_ERROR = 1
     REQUEST_ERROR = 2
@@ -102,6 +108,8 @@ class IAction(ILog):
 
         self.profile = profile
         self.dossier = dossier
+        # The id never changes, read it once instead of on every perform
+        self._dossier_id = dossier.get_id()
 
         self.query_path = './query/actions.graphql'
 
@@ -127,7 +135,7 @@ class IAction(ILog):
             else:
                 self.request = RequestBuilder(self.profile, self.query_path)
         except DemarchesSimpyException as e:
-            self.error('Error during creating request : '+ e.message)
+            self.error('Error during creating request : %s', e.message)
     
     @property
     def instructeur_id(self):
@@ -158,6 +166,32 @@ class IAction(ILog):
         '''
         pass
 
+    async def perform_async(self, *args, **kwargs) -> int:
+        r'''
+            Perform the action without blocking the event loop, takes the same arguments as :func:`perform`
+
+            The request is sent from the profile executor, so many actions (on different dossiers) can be
+            awaited together:
+
+            .. highlight:: python
+            .. code-block:: python
+
+                results = await asyncio.gather(*[
+                    StateModifier(profile, dossier).perform_async(DossierState.ACCEPTE)
+                    for dossier in dossiers
+                ])
+
+            Returns
+            -------
+                Same result code as :func:`perform`
+
+            Notes
+            -----
+                An action instance holds its own request state, do not await several perform_async of the same instance at the same time.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.profile.get_executor(), partial(self.perform, *args, **kwargs))
+
 class IData(ILog):
     r'''
         Internal class to create a data interface
@@ -172,12 +206,21 @@ class IData(ILog):
             default_variables : dict, optional
                 A dict of default variables to add to the request
 
+        Notes
+        -----
+            Data objects only send read queries, so their responses can be kept in the profile cache (see :class:`ResponseCache`)
+
     '''
+    __slots__ = ('_profile', 'has_been_fetched', 'data', 'request')
+
+    cacheable = True
+
     def __init__(self, request : RequestBuilder, profile : Profile, **kwargs) -> None:
         self._profile = profile
         self.has_been_fetched = False
         self.data = None
         self.request = request
+        self.request.cacheable = self.cacheable
 
 
         if 'default_variables' in kwargs and isinstance(kwargs['default_variables'], dict):
@@ -195,11 +238,12 @@ class IData(ILog):
         if not self.has_been_fetched:
             response = self.request.send_request()
             if response.status_code != 200:
-                self.error("Could not fetch data : "+str(response.status_code)+" "+response.reason if response.reason != None else '')
+                self.error("Could not fetch data : %s %s", response.status_code, response.reason or '')
+            content = response.json()
             #check if errors key is in response
-            if 'errors' in response.json():
-                self.error("Could not fetch data : "+str(response.json()['errors']))
-            self.data = response.json()['data']
+            if 'errors' in content:
+                self.error("Could not fetch data : %s", content['errors'])
+            self.data = content['data']
             self.has_been_fetched = True
             self.debug('Data fetched')
     def get_data(self) -> dict:
@@ -207,9 +251,18 @@ class IData(ILog):
         return self.data
     
     def force_fetch(self):
+        self.invalidate()
+        self.fetch()
+        return self
+
+    def invalidate(self):
+        r'''
+            Forget the data fetched by this object and remove its responses from the profile cache,
+            the next access to the data will be sent to the server
+        '''
         self.has_been_fetched = False
+        self.request.invalidate()
         self.__init_cache__()
-        self.fetch()
         return self
 
     def __init_cache__(self):
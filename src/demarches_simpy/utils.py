@@ -1,5 +1,8 @@
 from __future__ import annotations
 from enum import Enum
+from functools import wraps
+import random
+import time
 from shapely.geometry import shape
 from shapely import Geometry
 
@@ -15,14 +18,59 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 class DemarchesSimpyException(Exception):
-    def __init__(self,message="There was an error", header="MAIN",*args: object) -> None:
+    r'''
+    Exception raised by all objects of the package
+
+    Properties
+    ----------
+        status_code : int
+            The HTTP status code of the response that caused the error, if any
+        retry_after : float
+            The delay (in seconds) asked by the server before retrying, if any
+    '''
+    def __init__(self,message="There was an error", header="MAIN",*args: object, status_code : int = None, retry_after : float = None) -> None:
         super().__init__(message, *args)
         self.header = header
         self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
     def __str__(self) -> str:
         return f"{bcolors.FAIL} [ERROR] [{self.header}] {super().__str__()}{bcolors.ENDC}"
 
 
+def retry_on_status(statuses : tuple[int, ...], tries : int = 5, base : float = 0.2, max_delay : float = 30):
+    r'''
+    Decorator retrying a function when it raises a :class:`DemarchesSimpyException` with one of the given status codes
+
+    The delay between two tries is the Retry-After asked by the server if any, otherwise an exponential
+    backoff with jitter (a random delay between 0 and base * 2^attempt seconds), always capped by max_delay.
+
+    Parameters
+    ----------
+        statuses : tuple[int, ...]
+            The status codes to retry on
+        tries : int, optional
+            The maximum number of calls (default : 5)
+        base : float, optional
+            The base delay in seconds (default : 0.2)
+        max_delay : float, optional
+            The maximum delay in seconds between two tries (default : 30)
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(tries):
+                try:
+                    return func(*args, **kwargs)
+                except DemarchesSimpyException as e:
+                    if e.status_code not in statuses or attempt == tries - 1:
+                        raise
+                    delay = e.retry_after if e.retry_after is not None else random.uniform(0, base * 2 ** attempt)
+                    time.sleep(min(delay, max_delay))
+        return wrapper
+    return decorator
+
+
 class GeoSource(Enum):
     r'''
     The source of the GeoArea
@@ -13,7 +13,9 @@ class FakeRequestBuilder(RequestBuilder):
         self.response = response
         self.response.set_request(self)
     
-    def send_request(self):
+    def send_request(self, custom_body=None, **kwargs):
+        self.last_body = custom_body
+        self.last_kwargs = kwargs
         return self.response
 
 class FakeResponse(Response):
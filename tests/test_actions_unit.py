@@ -0,0 +1,176 @@
+import pytest
+import sys
+import asyncio
+import json
+sys.path.append('..')
+from src.demarches_simpy import Dossier, DossierState, Profile, MessageSender, StateModifier, AnnotationModifier, ActionBatch
+from src.demarches_simpy.connection import RequestBuilder
+from src.demarches_simpy.utils import DemarchesSimpyException
+from requests import Response
+
+from tests.fake_api import FakeRequestBuilder, FakeResponse
+
+
+class TestMessageSenderUnit():
+    def CONTENT(request : RequestBuilder):
+        return {
+            "data": {
+                "dossierEnvoyerMessage": {
+                    "message": {"id": "456"},
+                    "errors": None
+                }
+            }
+        }
+
+    @pytest.fixture
+    def profile(self):
+        return Profile('', instructeur_id='instructeur')
+
+    @pytest.fixture
+    def dossier(self, profile):
+        return Dossier(1234, profile, id='123', request=FakeRequestBuilder(profile, FakeResponse(200, lambda _ : {'data':{}})))
+
+    @pytest.fixture
+    def sender(self, profile, dossier):
+        sender = MessageSender(profile, dossier)
+        sender.request = FakeRequestBuilder(profile, FakeResponse(200, TestMessageSenderUnit.CONTENT))
+        return sender
+
+    def test_perform(self, sender : MessageSender):
+        assert sender.perform('foo') == MessageSender.SUCCESS
+        body = json.loads(sender.request.last_body())
+        assert body['operationName'] == 'dossierEnvoyerMessage'
+        assert body['variables']['input'] == {'dossierId' : '123', 'instructeurId' : 'instructeur', 'body' : 'foo', 'attachment' : None}
+
+    def test_no_instance_dict(self, sender : MessageSender):
+        assert not hasattr(sender, '__dict__')
+
+    def test_perform_async(self, profile : Profile, sender : MessageSender):
+        async def run():
+            return await asyncio.gather(sender.perform_async('foo'))
+        assert asyncio.run(run()) == [MessageSender.SUCCESS]
+        profile.close()
+
+
+class TestStateModifierUnit():
+    def CONTENT(request : RequestBuilder):
+        return {
+            "data": {
+                request.last_body['operationName']: {
+                    "dossier": {"id": "123"},
+                    "errors": None
+                }
+            }
+        }
+    def DOSSIER(request : RequestBuilder):
+        return {"data": {"dossier": {"id": "123", "number": 1234, "state": "en_construction"}}}
+
+    @pytest.fixture
+    def modifier(self):
+        profile = Profile('', instructeur_id='instructeur')
+        dossier = Dossier(1234, profile, id='123', request=FakeRequestBuilder(profile, FakeResponse(200, TestStateModifierUnit.DOSSIER)))
+        modifier = StateModifier(profile, dossier)
+        modifier.request = FakeRequestBuilder(profile, FakeResponse(200, TestStateModifierUnit.CONTENT))
+        return modifier
+
+    def test_no_instance_dict(self, modifier : StateModifier):
+        assert not hasattr(modifier, '__dict__')
+
+    def test_perform_instruction(self, modifier : StateModifier):
+        assert modifier.perform(DossierState.INSTRUCTION) == StateModifier.SUCCESS
+        body = modifier.request.last_body
+        assert body['operationName'] == 'dossierPasserEnInstruction'
+        assert body['variables'] == {'input' : {'dossierId' : '123', 'instructeurId' : 'instructeur'}}
+
+    def test_perform_with_motivation(self, modifier : StateModifier):
+        assert modifier.perform(DossierState.ACCEPTE, 'ok') == StateModifier.SUCCESS
+        assert modifier.request.last_body['operationName'] == 'dossierAccepter'
+        assert modifier.request.last_body['variables']['input']['motivation'] == 'ok'
+        modifier.perform(DossierState.CONSTRUCTION)
+        assert modifier.request.last_body['operationName'] == 'dossierRepasserEnConstruction'
+        assert 'motivation' not in modifier.request.last_body['variables']['input']
+
+    def test_dossier_refreshed_after_perform(self, modifier : StateModifier):
+        dossier = modifier.dossier
+        dossier.get_dossier_state()
+        assert dossier.has_been_fetched
+        modifier.perform(DossierState.ACCEPTE, 'ok')
+        assert not dossier.has_been_fetched
+        assert dossier.get_dossier_state() == 'en_construction'
+
+    def test_operation_names_exist(self, modifier : StateModifier):
+        from src.demarches_simpy.actions import _OP_NAMES, _OP_NAME_PASSER_EN_INSTRUCTION
+        for operation_name in (*_OP_NAMES.values(), _OP_NAME_PASSER_EN_INSTRUCTION):
+            assert operation_name in modifier.bodies
+
+    def test_perform_unknown_state(self, modifier : StateModifier):
+        with pytest.raises(DemarchesSimpyException):
+            modifier.perform('archive')
+
+
+class TestActionBatchUnit():
+    def CONTENT(request : RequestBuilder):
+        return {
+            "data": {
+                "a0": {"errors": None},
+                "a1": {"errors": [{"message": "invalid value"}]},
+            }
+        }
+
+    @pytest.fixture
+    def profile(self):
+        return Profile('', instructeur_id='instructeur')
+
+    @pytest.fixture
+    def batch(self, profile):
+        batch = ActionBatch(profile)
+        batch.request = FakeRequestBuilder(profile, FakeResponse(200, TestActionBatchUnit.CONTENT))
+        for number in (1, 2):
+            dossier = Dossier(number, profile, id=str(number), request=FakeRequestBuilder(profile, FakeResponse(200, lambda _ : {'data':{}})))
+            batch.add(AnnotationModifier(profile, dossier), {'id' : 'annotation', 'stringValue' : 'foo'})
+        return batch
+
+    def test_invalid_anotation(self, profile, batch : ActionBatch):
+        modifier = batch.actions[0][0]
+        with pytest.raises(DemarchesSimpyException):
+            batch.add(modifier, {'stringValue' : 'foo'})
+        with pytest.raises(DemarchesSimpyException):
+            batch.add(modifier, {'id' : 'annotation'})
+        batch.add(modifier, {'id' : 'annotation'}, 'foo')
+        assert len(batch) == 3
+
+    def test_body(self, batch : ActionBatch):
+        body = batch.__build_body__(batch.actions)
+        assert body['operationName'] == 'batch'
+        assert '$i0: DossierModifierAnnotationTextInput!' in body['query']
+        assert 'a1: dossierModifierAnnotationText(input: $i1)' in body['query']
+        assert body['variables']['i1']['dossierId'] == '2'
+        assert body['variables']['i1']['annotationId'] == 'annotation'
+
+    def test_flush(self, batch : ActionBatch):
+        assert batch.flush() == [AnnotationModifier.SUCCESS, AnnotationModifier.REQUEST_ERROR]
+        body = batch.request.last_body
+        assert 'a0: dossierModifierAnnotationText(input: $i0)' in body['query']
+        assert 'a1: dossierModifierAnnotationText(input: $i1)' in body['query']
+        assert [body['variables'][i]['dossierId'] for i in ('i0', 'i1')] == ['1', '2']
+        # The document is never sent as a persisted query
+        assert batch.request.last_kwargs['apq'] is False
+        assert len(batch) == 0
+        assert batch.flush() == []
+
+    def test_flush_partial_failure(self, profile, batch : ActionBatch):
+        class FakeSession():
+            def post(self, url, data, headers):
+                response = Response()
+                response.status_code = 200
+                response._content = json.dumps({
+                    "data" : {"a0" : {"errors" : None}, "a1" : None},
+                    "errors" : [{"message" : "Dossier not found", "path" : ["a1"]}]
+                }).encode()
+                return response
+        profile._session = FakeSession()
+        batch.request = RequestBuilder(profile, './query/empty.graphql')
+        invalidated = []
+        batch.actions[0][0].dossier.invalidate = lambda : invalidated.append(1)
+        assert batch.flush() == [AnnotationModifier.SUCCESS, AnnotationModifier.REQUEST_ERROR]
+        assert invalidated == [1]
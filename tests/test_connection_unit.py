@@ -0,0 +1,222 @@
+import pytest
+import sys
+import json
+import gzip
+sys.path.append('..')
+from src.demarches_simpy import connection, Dossier, MessageSender
+from src.demarches_simpy.connection import Profile, RequestBuilder, ResponseCache, load_query, compile_input_encoder, parse_retry_after, query_hash, APQ_HASH, APQ_REGISTER
+from src.demarches_simpy.utils import DemarchesSimpyException
+from requests import Response
+
+
+class TestProfileSession():
+    @pytest.fixture
+    def profile(self):
+        return Profile('')
+
+    def test_session_is_shared(self, profile : Profile):
+        assert profile.session is profile.session
+
+    def test_close(self, profile : Profile):
+        session = profile.session
+        profile.get_executor()
+        profile.close()
+        assert profile.executor is None
+        assert profile.session is not session
+
+
+def test_query_loaded_once():
+    profile = Profile('')
+    first = RequestBuilder(profile, './query/actions.graphql')
+    second = RequestBuilder(profile, './query/actions.graphql')
+    assert first.get_query() is second.get_query()
+    assert load_query.cache_info().hits > 0
+
+
+class TestResponseCache():
+    @pytest.fixture
+    def profile(self):
+        return Profile('', cache_ttl=60)
+
+    def test_key_is_canonical(self):
+        assert ResponseCache.key({'a' : 1, 'b' : 2}) == ResponseCache.key({'b' : 2, 'a' : 1})
+        assert ResponseCache.key({'a' : 1}) != ResponseCache.key({'a' : 2})
+
+    def test_expiration(self, profile : Profile):
+        profile.cache.put('key', 'response')
+        assert profile.cache.get('key') == 'response'
+        profile.cache.put('key', 'response', ttl=-1)
+        assert profile.cache.get('key') is None
+
+    def test_cacheable_request(self, profile : Profile):
+        request = RequestBuilder(profile, './query/empty.graphql')
+        request.cacheable = True
+        body = {'query' : request.get_query(), 'variables' : {}}
+        profile.cache.put(ResponseCache.key(body), 'response')
+        assert request.send_request() == 'response'
+        request.invalidate()
+        assert profile.cache.get(ResponseCache.key(body)) is None
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def json_backend(request, monkeypatch):
+    if request.param == 'json':
+        monkeypatch.setattr(connection, 'orjson', None)
+    # Encoders compiled with the other backend must not be reused
+    compile_input_encoder.cache_clear()
+    return request.param
+
+def test_input_encoder(json_backend):
+    encode = compile_input_encoder('mutation m { 100% }', 'm', ('id', 'value'))
+    body = json.loads(encode({'id' : '1', 'value' : 'quote " and %s'}))
+    assert body == {'query' : 'mutation m { 100% }', 'operationName' : 'm', 'variables' : {'input' : {'id' : '1', 'value' : 'quote " and %s'}}}
+    # Unexpected keys are encoded the generic way
+    body = json.loads(encode({'id' : '1', 'other' : 2}))
+    assert body['variables']['input'] == {'id' : '1', 'other' : 2}
+
+def test_input_encoder_shared():
+    profile = Profile('', instructeur_id='instructeur')
+    first = MessageSender(profile, Dossier(1, profile, id='1'))
+    second = MessageSender(profile, Dossier(2, profile, id='2'))
+    assert first.encode is second.encode
+
+def test_json_backend(json_backend):
+    assert connection.json_loads(connection.json_dumps({'b' : 1, 'a' : 'é'})) == {'b' : 1, 'a' : 'é'}
+    assert connection.json_dumps({'b' : 1, 'a' : 2}, sort_keys=True) == b'{"a":2,"b":1}'
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+class TestRetry():
+    class FakeSession():
+        def __init__(self, statuses):
+            self.statuses = list(statuses)
+        def post(self, url, data, headers):
+            response = Response()
+            response.status_code = self.statuses.pop(0)
+            response.headers['Retry-After'] = '0'
+            response._content = b'{"data" : {}}'
+            return response
+
+    def request(self, statuses, cacheable, max_retries=4):
+        profile = Profile('', max_retries=max_retries)
+        profile._session = TestRetry.FakeSession(statuses)
+        request = RequestBuilder(profile, './query/empty.graphql')
+        request.cacheable = cacheable
+        return request
+
+    def test_retry_then_success(self):
+        assert self.request([429, 503, 200], cacheable=False).send_request().status_code == 200
+
+    def test_mutation_not_retried_on_gateway_error(self):
+        with pytest.raises(DemarchesSimpyException) as excinfo:
+            self.request([502, 200], cacheable=False).send_request()
+        assert excinfo.value.status_code == 502
+
+    def test_read_retried_on_gateway_error(self):
+        assert self.request([502, 200], cacheable=True).send_request().status_code == 200
+
+    def test_no_retry(self):
+        with pytest.raises(DemarchesSimpyException):
+            self.request([503, 200], cacheable=True, max_retries=0).send_request()
+
+
+class TestPersistedQueries():
+    class FakeSession():
+        def __init__(self, contents):
+            self.contents = list(contents)
+            self.sent = []
+        def post(self, url, data, headers):
+            self.sent.append(json.loads(data))
+            response = Response()
+            response.status_code = 200
+            response._content = self.contents.pop(0)
+            return response
+
+    def request(self, contents):
+        profile = Profile('', apq=True)
+        profile._session = TestPersistedQueries.FakeSession(contents)
+        return RequestBuilder(profile, './query/empty.graphql')
+
+    def test_hash_only(self):
+        request = self.request([b'{"data" : {}}'])
+        request.send_request()
+        body = request.profile.session.sent[0]
+        assert 'query' not in body
+        assert body['extensions']['persistedQuery']['sha256Hash'] == query_hash(request.get_query())
+
+    def test_query_not_found(self):
+        request = self.request([b'{"errors" : [{"message" : "PersistedQueryNotFound"}]}', b'{"data" : {}}'])
+        assert request.send_request().json() == {'data' : {}}
+        first, second = request.profile.session.sent
+        assert 'query' not in first
+        assert second['query'] == request.get_query()
+        assert 'extensions' in second
+
+    def test_disabled_per_request(self):
+        request = self.request([b'{"data" : {}}'])
+        request.send_request({'query' : 'mutation batch { a0 : m }'}, apq=False)
+        assert request.profile.session.sent == [{'query' : 'mutation batch { a0 : m }'}]
+
+    def test_encoder(self):
+        encode = compile_input_encoder('mutation m', 'm', ('id',))
+        assert json.loads(encode({'id' : '1'}, apq=APQ_HASH)) == {
+            'extensions' : {'persistedQuery' : {'version' : 1, 'sha256Hash' : query_hash('mutation m')}},
+            'operationName' : 'm',
+            'variables' : {'input' : {'id' : '1'}}
+        }
+        assert json.loads(encode({'id' : '1'}, apq=APQ_REGISTER))['query'] == 'mutation m'
+
+
+class TestCompression():
+    class FakeSession():
+        def post(self, url, data, headers):
+            self.data, self.headers = data, headers
+            response = Response()
+            response.status_code = 200
+            response._content = b'{"data" : {}}'
+            return response
+
+    def request(self, compression):
+        profile = Profile('', compression=compression)
+        profile._session = TestCompression.FakeSession()
+        return RequestBuilder(profile, './query/empty.graphql')
+
+    def test_large_body_compressed(self):
+        request = self.request(True)
+        request.send_request({'query' : 'x' * 5000})
+        assert request.profile.session.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(request.profile.session.data)) == {'query' : 'x' * 5000}
+
+    def test_small_body_not_compressed(self):
+        request = self.request(True)
+        request.send_request({'query' : 'x'})
+        assert 'Content-Encoding' not in request.profile.session.headers
+
+    def test_disabled(self):
+        request = self.request(False)
+        request.send_request({'query' : 'x' * 5000})
+        assert 'Content-Encoding' not in request.profile.session.headers
+
+
+class TestHttp2():
+    def test_httpx_missing(self, monkeypatch):
+        monkeypatch.setattr(connection, 'httpx', None)
+        with pytest.raises(DemarchesSimpyException):
+            Profile('', http2=True)
+
+    def test_response_converted(self):
+        httpx = pytest.importorskip('httpx')
+        handler = lambda request : httpx.Response(200, content=b'{"data" : {"ok" : true}}', headers={'Retry-After' : '1'})
+        profile = Profile('', http2=True)
+        profile._session = connection.Http2Session(httpx.Client(transport=httpx.MockTransport(handler)))
+        resp = RequestBuilder(profile, './query/empty.graphql').send_request({'query' : 'x'})
+        assert isinstance(resp, Response)
+        assert resp.ok and resp.json() == {'data' : {'ok' : True}}
+        assert resp.headers['retry-after'] == '1'
+        profile.close()
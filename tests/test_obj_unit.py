@@ -2,6 +2,7 @@ import pytest
 import sys
 sys.path.append('..')
 from src.demarches_simpy.dossier import Dossier, DossierState
+from src.demarches_simpy.demarche import Demarche
 from src.demarches_simpy.connection import RequestBuilder, Profile
 from src.demarches_simpy.fields import Field
 from src.demarches_simpy.utils import DemarchesSimpyException
@@ -111,6 +112,132 @@ class TestDossierNoError():
         assert instructeur2['email'] == "instructeur2@foo.fr"
 
 
+class TestDemarcheNoError():
+    PAGES = {
+        None : ([{"id" : "1", "number" : 1}, {"id" : "2", "number" : 2}], "cursor-1", True),
+        "cursor-1" : ([{"id" : "3", "number" : 3}], "cursor-2", False),
+    }
+    def CONTENT(request : RequestBuilder):
+        variables = request.last_body['variables'] if request.last_body else request.get_variables()
+        nodes, end_cursor, has_next = TestDemarcheNoError.PAGES[variables.get('cursor')]
+        data = {
+            "data": {
+                "demarche": {
+                    "id": "123",
+                    "number": 123,
+                    "title": "foo",
+                    "dossiers": {
+                        "nodes": nodes,
+                        "pageInfo": {"endCursor": end_cursor, "hasNextPage": has_next}
+                    }
+                }
+            }
+        }
+        if variables.get('includeDossiers') is False:
+            del data['data']['demarche']['dossiers']
+        if variables.get('includeInstructeurs'):
+            data['data']['demarche']['groupeInstructeurs'] = [
+                {"instructeurs" : [{"id" : "1", "email" : "instructeur1@foo.fr"}]},
+                {"instructeurs" : [{"id" : "2", "email" : "instructeur2@foo.fr"}, {"id" : "3", "email" : "instructeur3@foo.fr"}]},
+            ]
+        return data
+
+    class CountingRequestBuilder(FakeRequestBuilder):
+        sent = 0
+        failures = 0
+        def send_request(self, custom_body=None, **kwargs):
+            self.sent += 1
+            if self.failures > 0:
+                self.failures -= 1
+                raise DemarchesSimpyException(message='Server unavailable')
+            return super().send_request(custom_body)
+
+    @pytest.fixture
+    def demarche(self):
+        profile = Profile('')
+        resp = FakeResponse(200, TestDemarcheNoError.CONTENT)
+        request = TestDemarcheNoError.CountingRequestBuilder(profile, resp)
+        demarche = Demarche(123, profile)
+        demarche.request = request
+        demarche.force_fetch()
+        request.sent = 0
+        return demarche
+
+    def test_no_instance_dict(self, demarche : Demarche):
+        assert not hasattr(demarche, '__dict__')
+
+    def test_dossier_infos(self, demarche : Demarche):
+        assert demarche.get_dossier_infos(limit=1) == [("1", 1)]
+        # The first page is enough, the next one is not prefetched
+        assert demarche._next_page is None
+        assert demarche.get_dossier_infos() == [("1", 1), ("2", 2), ("3", 3)]
+        # The first page was fetched with the demarche data
+        assert demarche.request.sent == 1
+
+    def test_get_instructeurs_info(self, demarche : Demarche):
+        instructeurs = demarche.get_instructeurs_info()
+        assert [i['id'] for i in instructeurs] == ["1", "2", "3"]
+        assert demarche.get_instructeur_by_email("instructeur2@foo.fr")['id'] == "2"
+        assert demarche.get_instructeur_by_email("nobody@foo.fr") is None
+        assert demarche.request.sent == 1
+
+    def test_iter_dossiers_is_lazy(self, demarche : Demarche):
+        dossiers = demarche.iter_dossiers()
+        assert next(dossiers).number == 1
+        assert len(demarche.dossiers) == 1
+        assert [d.number for d in dossiers] == [2, 3]
+
+    def test_next_page_is_prefetched(self, demarche : Demarche):
+        next(demarche.iter_dossiers())
+        assert demarche._next_page is not None
+        demarche._next_page.result()
+        assert demarche.request.sent == 1
+        assert len(demarche.get_dossier_infos()) == 3
+        assert demarche.request.sent == 1
+
+    def test_failed_prefetch(self, demarche : Demarche):
+        demarche.request.failures = 2
+        next(demarche.iter_dossiers())
+        # The prefetch and the page fetched again both fail
+        with pytest.raises(DemarchesSimpyException):
+            demarche.get_dossier_infos()
+        assert demarche.get_dossier_infos() == [("1", 1), ("2", 2), ("3", 3)]
+        assert demarche.request.sent == 3
+
+    def test_prefetch_dropped_on_force_fetch(self, demarche : Demarche):
+        next(demarche.iter_dossiers())
+        pending = demarche._next_page
+        demarche.force_fetch()
+        if not pending.cancelled():
+            pending.result()
+        assert demarche._next_page is None
+        assert len(demarche.get_dossier_infos()) == 3
+
+    def test_first_page_fetched_alone(self, demarche : Demarche):
+        demarche.request.add_variable('includeDossiers', False)
+        demarche.force_fetch()
+        demarche.request.sent = 0
+        assert demarche.get_dossier_infos(limit=1) == [("1", 1)]
+        assert demarche._next_page is None
+        assert demarche.request.sent == 1
+
+    def test_dossier_pages_are_slim(self, demarche : Demarche):
+        demarche.request.add_variable('includeRevision', True)
+        demarche.get_dossier_infos()
+        assert demarche.request.last_body['variables'] == {"demarcheNumber" : 123, "cursor" : "cursor-1"}
+
+    def test_dossiers_count_is_cached(self, demarche : Demarche):
+        assert demarche.get_dossiers_count() == 3
+        assert demarche.get_dossiers_count() == 3
+        assert len(demarche.get_dossier_infos(limit=-1)) == 3
+        assert demarche.request.sent == 1
+
+    def test_get_dossiers(self, demarche : Demarche):
+        dossiers = demarche.get_dossiers(limit=2, dossier_filter=lambda d : d.number != 1)
+        assert [d.number for d in dossiers] == [2, 3]
+        assert demarche.get_dossiers()[0] is demarche.get_dossiers()[0]
+
+
 class TestDossierError():
     @pytest.fixture
     def dossier(self):
@@ -1,7 +1,7 @@
 import pytest
 import sys
 sys.path.append('..')
-from src.demarches_simpy.utils import bcolors, DemarchesSimpyException
+from src.demarches_simpy.utils import bcolors, DemarchesSimpyException, retry_on_status
 
 def test_DemarchesSimpyException():
     with pytest.raises(DemarchesSimpyException) as excinfo:
@@ -9,6 +9,31 @@ def test_DemarchesSimpyException():
     assert str(excinfo.value) == f"{bcolors.FAIL} [ERROR] [MAIN] There was an error{bcolors.ENDC}"
 
 
+def test_retry_on_status(monkeypatch):
+    delays = []
+    monkeypatch.setattr('time.sleep', delays.append)
+    calls = []
+    @retry_on_status((503,), tries=3)
+    def unavailable():
+        calls.append(1)
+        raise DemarchesSimpyException(status_code=503, retry_after=2 if len(calls) == 1 else None)
+    with pytest.raises(DemarchesSimpyException):
+        unavailable()
+    assert len(calls) == 3
+    assert delays[0] == 2
+    assert 0 <= delays[1] <= 0.4
+
+def test_retry_on_status_other_error():
+    calls = []
+    @retry_on_status((503,))
+    def bad_request():
+        calls.append(1)
+        raise DemarchesSimpyException(status_code=400)
+    with pytest.raises(DemarchesSimpyException):
+        bad_request()
+    assert len(calls) == 1
+
+
 from src.demarches_simpy.dossier import DossierState
 
 
@@ -32,4 +57,21 @@ def test_DossierState_build_query():
     assert DossierState.__build_query_suffix__(DossierState.ACCEPTE) == 'Accepter'
     assert DossierState.__build_query_suffix__(DossierState.REFUSE) == 'Refuser'
     assert DossierState.__build_query_suffix__(DossierState.SANS_SUITE) == 'ClasserSansSuite'
-    
\ No newline at end of file
+    
+def test_ILog_lazy_format(capsys):
+    from src.demarches_simpy.interfaces import ILog
+    class Formatted:
+        calls = 0
+        def __str__(self):
+            Formatted.calls += 1
+            return 'formatted'
+    log = ILog('TEST', None, verbose=False)
+    log.debug('Skipped %s', Formatted())
+    assert Formatted.calls == 0
+    log.info('Shown %s', Formatted())
+    assert Formatted.calls == 1
+    assert 'Shown formatted' in capsys.readouterr().out
+    with pytest.raises(DemarchesSimpyException) as excinfo:
+        log.error('Failed : %s', 503, status_code=503)
+    assert excinfo.value.status_code == 503
+    assert 'Failed : 503' in str(excinfo.value)